@@ -1,25 +1,56 @@
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import json
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+
+try:
+    import orjson as json
+except ImportError:
+    import json
 
 import i2c_driver
 
 
 HTTP_PORT=8000
+MAX_BODY=4096
+# Matches BaseHTTPRequestHandler's default protocol_version
+RESPONSE_OK=b"HTTP/1.0 200 OK\r\nContent-Length: 0\r\n\r\n"
+# Custom character 0, the plane glyph loaded in main()
+SEP="\0"
 
 
 def handler_for_screen(screen):
+    screen_write = screen.lcd_display_string
+    # The I2C bus isn't safe to share between request threads, and both lines
+    # of a flight should be written together.
+    screen_lock = threading.Lock()
 
     class Handler(BaseHTTPRequestHandler):
         def do_POST(self):
-            content_len = int(self.headers.get('content-length'))
+            try:
+                content_len = int(self.headers['Content-Length'])
+            except (TypeError, ValueError):
+                content_len = -1
+            if content_len < 0:
+                self.send_error(400, "Missing or invalid Content-Length")
+                return
+            if content_len > MAX_BODY:
+                self.send_error(413)
+                return
             body_bytes = self.rfile.read(content_len)
-            body = json.loads(body_bytes)
-            print('POST body', body)
-            (ident, actype) = (body['Ident'], body['AircraftType'])
-            screen.lcd_display_string(f"{ident} ({actype})")
-            (orig, dest) = (body['Origin'], body['Destination'])
-            screen.lcd_display_string(f"{orig}\0{dest}", 2)
-            self.send_response(200)
+            try:
+                body = json.loads(body_bytes)
+                print('POST body', body)
+                lines = (
+                    f"{body['Ident']} ({body['AircraftType']})",
+                    f"{body['Origin']}{SEP}{body['Destination']}",
+                )
+            except (ValueError, TypeError, KeyError) as e:
+                self.send_error(400, f"Invalid flight: {e}")
+                return
+            with screen_lock:
+                for (line, text) in enumerate(lines, 1):
+                    screen_write(text, line)
+            self.log_request(200)
+            self.wfile.write(RESPONSE_OK)
 
     return Handler
 
@@ -40,7 +71,7 @@ def main():
     ])
 
     server_address = ("localhost", HTTP_PORT)
-    server = HTTPServer(server_address, handler_for_screen(screen))
+    server = ThreadingHTTPServer(server_address, handler_for_screen(screen))
     print(f"Starting HTTP server on port {HTTP_PORT}")
     server.serve_forever()
 
@@ -1,9 +1,11 @@
-import os
 import sys
 import signal
 import logging
-import re
+import queue
+import subprocess
+import threading
 import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 import math
 import requests
@@ -12,7 +14,148 @@ from geopy.point import Point
 from argparse import ArgumentParser
 import toml
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 CLEANUP_AFTER = timedelta(minutes=10)
+CLEANUP_AFTER_SECONDS = CLEANUP_AFTER.total_seconds()
+CLEANUP_INTERVAL_SECONDS = 30
+BATCH_MIN_SIZE = 8
+SAY_QUEUE_SIZE = 16
+EARTH_RADIUS_NM = 3440.065
+
+ICAO_CALLSIGNS = {
+    "UAL": "united",
+    "FDX": "fedex",
+    "DAL": "delta",
+    "KAP": "cair",
+    "NKS": "spirit",
+    "RPA": "brickyard",
+    "ACA": "air canada",
+    "POE": "porter",
+    "SWA": "southwest",
+    "JBU": "jet blue",
+    "EIN": "shamrock",
+    "AAL": "american",
+    "ASA": "alaska",
+    "FFT": "frontier flight",
+    "JAL": "japan air",
+    "JZA": "jazz",
+    "AFR": "air france",
+    "FPY": "player",
+    "WUP": "up jet",
+    "BAW": "speed bird",
+    "VJA": "vista am",
+}
+
+PHONETIC_ALPHABET = {
+    "A": "alpha",
+    "B": "bravo",
+    "C": "charlie",
+    "D": "delta",
+    "E": "echo",
+    "F": "foxtrot",
+    "G": "golf",
+    "H": "hotel",
+    "I": "india",
+    "J": "juliet",
+    "K": "kilo",
+    "L": "lima",
+    "M": "mike",
+    "N": "november",
+    "O": "oscar",
+    "P": "papa",
+    "Q": "quebec",
+    "R": "romeo",
+    "S": "sierra",
+    "T": "tango",
+    "U": "uniform",
+    "V": "victor",
+    "W": "whiskey",
+    "X": "x-ray",
+    "Y": "yankee",
+    "Z": "zulu",
+    "0": "zero",
+    "1": "one",
+    "2": "two",
+    "3": "three",
+    "4": "four",
+    "5": "five",
+    "6": "six",
+    "7": "seven",
+    "8": "eight",
+    "9": "niner",
+    ".": "point",
+}
+
+
+def _build_phonetic_table():
+    table = [None] * 128
+    for char, word in PHONETIC_ALPHABET.items():
+        table[ord(char)] = word
+        table[ord(char.lower())] = word
+    return table
+
+
+# PHONETIC_ALPHABET indexed by ord() for either case of each ASCII character
+PHONETIC_TABLE = _build_phonetic_table()
+
+CARDINAL_DIRECTIONS = (
+    "north",
+    "northeast",
+    "east",
+    "southeast",
+    "south",
+    "southwest",
+    "west",
+    "northwest",
+)
+
+
+def _haversine_nm(lat1_rad, lon1_rad, cos_lat1, lat2_rad, lon2_rad, cos_lat2):
+    """Great-circle distance in nautical miles between two points given in radians."""
+    sin_dlat = math.sin((lat2_rad - lat1_rad) / 2)
+    sin_dlon = math.sin((lon2_rad - lon1_rad) / 2)
+    a = sin_dlat * sin_dlat + cos_lat1 * cos_lat2 * sin_dlon * sin_dlon
+    return 2 * EARTH_RADIUS_NM * math.asin(math.sqrt(a))
+
+
+def _haversine_nm_vec(lat1_rad, lon1_rad, cos_lat1, lats_rad, lons_rad):
+    """Vectorized _haversine_nm from one point to arrays of points in radians."""
+    sin_dlat = np.sin((lats_rad - lat1_rad) / 2)
+    sin_dlon = np.sin((lons_rad - lon1_rad) / 2)
+    a = sin_dlat * sin_dlat + cos_lat1 * np.cos(lats_rad) * sin_dlon * sin_dlon
+    return 2 * EARTH_RADIUS_NM * np.arcsin(np.sqrt(a))
+
+
+def _bearing_deg(lon1_rad, sin_lat1, cos_lat1, lon2_rad, sin_lat2, cos_lat2):
+    """Initial great-circle bearing in degrees from the first point to the second."""
+    dlon = lon2_rad - lon1_rad
+    y = math.sin(dlon) * cos_lat2
+    x = cos_lat1 * sin_lat2 - sin_lat1 * cos_lat2 * math.cos(dlon)
+    return math.degrees(math.atan2(y, x)) % 360
+
+
+@dataclass(slots=True)
+class Position:
+    flight_id: str
+    latitude: float
+    longitude: float
+    lat_rad: float
+    lon_rad: float
+    sin_lat: float
+    cos_lat: float
+    altitude: float | None
+    ident: str
+    reg: str
+    origin: str
+    destination: str
+    aircraft_type: str
+    speed: float | None
+    heading: float | None
+    timestamp_epoch: int
 
 
 class App:
@@ -21,12 +164,22 @@ class App:
         self.password = config["password"]
         self.latitude = config["latitude"]
         self.longitude = config["longitude"]
+        self._my_lat_rad = math.radians(self.latitude)
+        self._my_lon_rad = math.radians(self.longitude)
+        self._my_sin_lat = math.sin(self._my_lat_rad)
+        self._my_cos_lat = math.cos(self._my_lat_rad)
+        self._my_point = Point(self.latitude, self.longitude)
         self.interesting_radius_nm = config["interesting_radius"]
         self.interesting_ceiling_ft = config["interesting_ceiling"]
         self.alert_radius_nm = config["alert_radius"]
         self.announce = config["announce"]
         self.flights = {}
-        self.current_time = None
+        self.current_time_epoch = None
+        self._last_cleanup = None
+        self._observation_box = self._compute_observation_box()
+        self._say_q = queue.Queue(maxsize=SAY_QUEUE_SIZE)
+        if self.announce:
+            threading.Thread(target=self._say_worker, daemon=True).start()
 
     def run(self):
         try:
@@ -48,44 +201,90 @@ class App:
         pass
 
     def _process_messages(self):
-        # Fetch and process messages from the Firehose stream
+        # Fetch and process messages from the Firehose stream, passing each
+        # burst of position messages to handle_positions
         pass
 
     def cleanup_stale_flights(self):
-        now = datetime.utcnow()
-        self.flights = {
-            k: v
-            for k, v in self.flights.items()
-            if v["timestamp"] + CLEANUP_AFTER > now
-        }
+        now = self.current_time_epoch
+        if now is None:
+            return
+        if (
+            self._last_cleanup is not None
+            and now - self._last_cleanup <= CLEANUP_INTERVAL_SECONDS
+        ):
+            return
+        self._last_cleanup = now
+
+        cutoff = now - CLEANUP_AFTER_SECONDS
+        stale = [k for k, v in self.flights.items() if v.timestamp_epoch <= cutoff]
+        for k in stale:
+            del self.flights[k]
 
     def flight_observation_box(self):
-        center = self.my_location()
-        min_lat = self.move_nm(center, 180, self.interesting_radius_nm)
-        max_lat = self.move_nm(center, 0, self.interesting_radius_nm)
-        min_lon = self.move_nm(center, 270, self.interesting_radius_nm)
-        max_lon = self.move_nm(center, 90, self.interesting_radius_nm)
+        return self._observation_box
+
+    def _compute_observation_box(self):
+        # Bound the interesting circle on the same sphere calculate_distance
+        # uses, so the box never rejects a position the distance check would
+        # accept. The radius is padded slightly to absorb rounding at the edge.
+        radius = self.interesting_radius_nm / EARTH_RADIUS_NM * (1 + 1e-9)
+        low_lat = self._my_lat_rad - radius
+        hi_lat = self._my_lat_rad + radius
+        if low_lat <= -math.pi / 2 or hi_lat >= math.pi / 2:
+            # The circle contains a pole, so it spans every longitude.
+            low_lat = max(low_lat, -math.pi / 2)
+            hi_lat = min(hi_lat, math.pi / 2)
+            low_lon = -math.pi
+            hi_lon = math.pi
+        else:
+            # Widest point of the circle, which is poleward of due east/west.
+            dlon = math.asin(math.sin(radius) / self._my_cos_lat)
+            low_lon = self._my_lon_rad - dlon
+            hi_lon = self._my_lon_rad + dlon
+            # Across the antimeridian this leaves low_lon > hi_lon.
+            if low_lon < -math.pi:
+                low_lon += 2 * math.pi
+            if hi_lon > math.pi:
+                hi_lon -= 2 * math.pi
         return {
-            "low_lat": min_lat.latitude,
-            "low_lon": min_lon.longitude,
-            "hi_lat": max_lat.latitude,
-            "hi_lon": max_lon.longitude,
+            "low_lat": math.degrees(low_lat),
+            "low_lon": math.degrees(low_lon),
+            "hi_lat": math.degrees(hi_lat),
+            "hi_lon": math.degrees(hi_lon),
         }
 
+    def _in_observation_box(self, lat, lon):
+        """Box test for degrees, given as floats or as NumPy arrays."""
+        box = self._observation_box
+        in_lat = (box["low_lat"] <= lat) & (lat <= box["hi_lat"])
+        if box["low_lon"] <= box["hi_lon"]:
+            in_lon = (box["low_lon"] <= lon) & (lon <= box["hi_lon"])
+        else:
+            in_lon = (box["low_lon"] <= lon) | (lon <= box["hi_lon"])
+        return in_lat & in_lon
+
     def is_interesting(self, pos):
-        dist = self.calculate_distance(pos["point"])
-        if dist > self.interesting_radius_nm:
+        # Cheapest checks first: altitude, then the bounding box, and only
+        # then the actual distance.
+        if pos.altitude is not None and pos.altitude > self.interesting_ceiling_ft:
             return False
-        if pos["altitude"] and pos["altitude"] > self.interesting_ceiling_ft:
+        if not self._in_observation_box(pos.latitude, pos.longitude):
             return False
-        return True
-
-    def calculate_distance(self, point):
-        my_location = self.my_location()
-        return geodesic(my_location, point).nautical
+        return self.calculate_distance(pos) <= self.interesting_radius_nm
+
+    def calculate_distance(self, pos):
+        return _haversine_nm(
+            self._my_lat_rad,
+            self._my_lon_rad,
+            self._my_cos_lat,
+            pos.lat_rad,
+            pos.lon_rad,
+            pos.cos_lat,
+        )
 
     def my_location(self):
-        return Point(self.latitude, self.longitude)
+        return self._my_point
 
     def handle_position(self, msg):
         curr = self.new_position(msg)
@@ -93,52 +292,118 @@ class App:
             logging.warning("could not translate position message")
             return
 
-        self.current_time = curr["timestamp"]
+        self.current_time_epoch = curr.timestamp_epoch
         if not self.is_interesting(curr):
             return
+        self.track_position(curr)
+
+    def handle_positions(self, msgs):
+        new_position = self.new_position
+        positions = []
+        append = positions.append
+        for msg in msgs:
+            if pos := new_position(msg):
+                append(pos)
+            else:
+                logging.warning("could not translate position message")
+        if not positions:
+            return
 
-        if prev := self.flights.get(curr["flight_id"]):
-            dist_to_prev = self.calculate_distance(prev["point"])
-            dist_to_curr = self.calculate_distance(curr["point"])
+        # Scoring a burst in one go is only worth the array setup once there
+        # are enough positions; small batches, or no NumPy, stay on the
+        # scalar path.
+        if np is not None and len(positions) > BATCH_MIN_SIZE:
+            interesting = self.interesting_mask(positions)
+        else:
+            is_interesting = self.is_interesting
+            interesting = [is_interesting(pos) for pos in positions]
+
+        track_position = self.track_position
+        for curr, keep in zip(positions, interesting):
+            if keep:
+                track_position(curr)
+        # Nothing reads the clock while tracking, so set it once per batch.
+        self.current_time_epoch = positions[-1].timestamp_epoch
+
+    def interesting_mask(self, positions):
+        """Vectorized is_interesting, applying the same checks to every position."""
+        n = len(positions)
+        lats = np.fromiter((pos.latitude for pos in positions), float, count=n)
+        lons = np.fromiter((pos.longitude for pos in positions), float, count=n)
+        lats_rad = np.fromiter((pos.lat_rad for pos in positions), float, count=n)
+        lons_rad = np.fromiter((pos.lon_rad for pos in positions), float, count=n)
+        alts = np.fromiter(
+            (pos.altitude or np.nan for pos in positions), float, count=n
+        )
+        dist = _haversine_nm_vec(
+            self._my_lat_rad, self._my_lon_rad, self._my_cos_lat, lats_rad, lons_rad
+        )
+        # NaN altitudes compare False, so positions without one are kept.
+        return (
+            ~(alts > self.interesting_ceiling_ft)
+            & self._in_observation_box(lats, lons)
+            & (dist <= self.interesting_radius_nm)
+        )
+
+    def track_position(self, curr):
+        flights = self.flights
+        flight_id = curr.flight_id
+        if prev := flights.get(flight_id):
+            calculate_distance = self.calculate_distance
+            dist_to_prev = calculate_distance(prev)
+            dist_to_curr = calculate_distance(curr)
             if dist_to_curr < dist_to_prev and dist_to_curr < self.alert_radius_nm:
-                self.alert(curr)
+                self.alert(curr, dist_to_curr, self.bearing_towards(curr))
 
-        self.flights[curr["flight_id"]] = curr
+        flights[flight_id] = curr
 
-    def alert(self, curr):
-        self.display_flight(curr)
+    def alert(self, curr, dist_nm, bearing_deg):
+        self.display_flight(curr, dist_nm, bearing_deg)
         if self.announce:
-            self.say(curr)
+            self.say(curr, dist_nm, bearing_deg)
 
-    def display_flight(self, curr):
-        me = self.my_location()
-        dist = self.calculate_distance(curr["point"])
-        bearing = self.bearing_towards(curr["point"])
-        alert = f"[{curr['timestamp'].strftime('%H:%M:%S')}] {curr['ident']} ({curr['aircraft_type']}) from {curr['origin']} to {curr['destination']} is {dist:.1f}nm to the {self.cardinal_direction(bearing)} at {curr['altitude']:.0f}ft travelling {self.cardinal_direction(curr['heading'])}bound at {curr['speed']:.0f}kts"
+    def display_flight(self, curr, dist_nm, bearing_deg):
+        alert = f"[{datetime.utcfromtimestamp(curr.timestamp_epoch).strftime('%H:%M:%S')}] {curr.ident} ({curr.aircraft_type}) from {curr.origin} to {curr.destination} is {dist_nm:.1f}nm to the {self.cardinal_direction(bearing_deg)} at {curr.altitude:.0f}ft travelling {self.cardinal_direction(curr.heading)}bound at {curr.speed:.0f}kts"
         print(alert)
 
-    def say(self, curr):
+    def say(self, curr, dist_nm, bearing_deg):
         words = [
-            *self.ident_to_words(curr["ident"]),
+            *self.ident_to_words(curr.ident),
             "is",
-            *self.phonetic(f"{self.calculate_distance(curr['point']):.1f}"),
+            *self.phonetic(f"{dist_nm:.1f}"),
             "nautical miles",
             "to the",
-            self.cardinal_direction(self.bearing_towards(curr["point"])),
+            self.cardinal_direction(bearing_deg),
             ",",
         ]
-        if curr["altitude"]:
-            words += ["at", *self.altitude_to_words(curr["altitude"]), ","]
-        if curr["heading"]:
-            words += [self.cardinal_direction(curr["heading"]), "bound", ","]
-        if curr["speed"]:
-            words += [*self.phonetic(f"{curr['speed']:.0f}"), "knots"]
+        if curr.altitude:
+            words += ["at", *self.altitude_to_words(curr.altitude), ","]
+        if curr.heading:
+            words += [self.cardinal_direction(curr.heading), "bound", ","]
+        if curr.speed:
+            words += [*self.phonetic(f"{curr.speed:.0f}"), "knots"]
         alert = " ".join(words)
-        os.system(f"say -r 200 '{alert}'")
+        try:
+            self._say_q.put_nowait(alert)
+        except queue.Full:
+            logging.warning("dropping announcement, speech is backed up")
+
+    def _say_worker(self):
+        while True:
+            alert = self._say_q.get()
+            try:
+                subprocess.run(["say", "-r", "200", alert], check=False)
+            except (OSError, subprocess.SubprocessError) as e:
+                logging.error(f"Error announcing flight: {e}")
+            finally:
+                self._say_q.task_done()
 
     def new_position(self, msg):
         try:
-            point = Point(float(msg["lat"]), float(msg["lon"]))
+            lat = float(msg["lat"])
+            lon = float(msg["lon"])
+            lat_rad = math.radians(lat)
+            lon_rad = math.radians(lon)
             altitude = float(msg["alt"]) if msg["alt"] else None
             speed = float(msg["gs"]) if msg["gs"] else None
             heading = (
@@ -146,59 +411,51 @@ class App:
                 if msg["heading_true"]
                 else (float(msg["heading"]) if msg["heading"] else None)
             )
-            timestamp = datetime.utcfromtimestamp(int(msg["clock"]))
-            return {
-                "flight_id": msg["id"],
-                "point": point,
-                "altitude": altitude,
-                "ident": msg["ident"],
-                "reg": msg["reg"],
-                "origin": msg["orig"],
-                "destination": msg["dest"],
-                "aircraft_type": msg["aircraft_type"],
-                "speed": speed,
-                "heading": heading,
-                "timestamp": timestamp,
-            }
+            return Position(
+                flight_id=msg["id"],
+                latitude=lat,
+                longitude=lon,
+                lat_rad=lat_rad,
+                lon_rad=lon_rad,
+                sin_lat=math.sin(lat_rad),
+                cos_lat=math.cos(lat_rad),
+                altitude=altitude,
+                ident=msg["ident"],
+                reg=msg["reg"],
+                origin=msg["orig"],
+                destination=msg["dest"],
+                aircraft_type=msg["aircraft_type"],
+                speed=speed,
+                heading=heading,
+                timestamp_epoch=int(msg["clock"]),
+            )
         except Exception as e:
             logging.error(f"Error parsing message: {e}")
             return None
 
-    def bearing_towards(self, point):
-        return geodesic(self.my_location(), point).initial
+    def bearing_towards(self, pos):
+        return _bearing_deg(
+            self._my_lon_rad,
+            self._my_sin_lat,
+            self._my_cos_lat,
+            pos.lon_rad,
+            pos.sin_lat,
+            pos.cos_lat,
+        )
 
     def cardinal_direction(self, bearing):
-        if bearing > 337.5 or bearing <= 22.5:
-            return "north"
-        if bearing > 22.5 and bearing <= 67.5:
-            return "northeast"
-        if bearing > 67.5 and bearing <= 112.5:
-            return "east"
-        if bearing > 112.5 and bearing <= 157.5:
-            return "southeast"
-        if bearing > 157.5 and bearing <= 202.5:
-            return "south"
-        if bearing > 202.5 and bearing <= 247.5:
-            return "southwest"
-        if bearing > 247.5 and bearing <= 292.5:
-            return "west"
-        if bearing > 292.5 and bearing <= 337.5:
-            return "northwest"
-        return ""
+        return CARDINAL_DIRECTIONS[int((bearing + 22.5) // 45) % 8]
 
     def ident_to_words(self, ident):
-        icao_regex = re.compile("^[A-Z]{3}")
-        icao = icao_regex.match(ident)
-        if not icao:
-            return self.phonetic(ident)
+        # Callsigns are keyed by three-letter uppercase ICAO codes, so the
+        # lookup itself rejects anything that doesn't start with one.
+        callsign = self.icao_callsign(ident[:3])
         suffix = ident[3:]
-        callsign = self.icao_callsign(icao.group(0))
         if not callsign:
             return self.phonetic(ident)
 
         words = [callsign]
-        number_regex = re.compile("^[0-9]{2,4}$")
-        if number_regex.match(suffix):
+        if 2 <= len(suffix) <= 4 and suffix.isascii() and suffix.isdigit():
             if len(suffix) == 2:
                 words.append(suffix)
             elif len(suffix) == 3:
@@ -212,30 +469,7 @@ class App:
         return words
 
     def icao_callsign(self, icao):
-        callsigns = {
-            "UAL": "united",
-            "FDX": "fedex",
-            "DAL": "delta",
-            "KAP": "cair",
-            "NKS": "spirit",
-            "RPA": "brickyard",
-            "ACA": "air canada",
-            "POE": "porter",
-            "SWA": "southwest",
-            "JBU": "jet blue",
-            "EIN": "shamrock",
-            "AAL": "american",
-            "ASA": "alaska",
-            "FFT": "frontier flight",
-            "JAL": "japan air",
-            "JZA": "jazz",
-            "AFR": "air france",
-            "FPY": "player",
-            "WUP": "up jet",
-            "BAW": "speed bird",
-            "VJA": "vista am",
-        }
-        return callsigns.get(icao)
+        return ICAO_CALLSIGNS.get(icao)
 
     def altitude_to_words(self, altitude):
         words = []
@@ -250,49 +484,10 @@ class App:
         return words
 
     def phonetic(self, plain):
-        alphabet = {
-            "A": "alpha",
-            "B": "bravo",
-            "C": "charlie",
-            "D": "delta",
-            "E": "echo",
-            "F": "foxtrot",
-            "G": "golf",
-            "H": "hotel",
-            "I": "india",
-            "J": "juliet",
-            "K": "kilo",
-            "L": "lima",
-            "M": "mike",
-            "N": "november",
-            "O": "oscar",
-            "P": "papa",
-            "Q": "quebec",
-            "R": "romeo",
-            "S": "sierra",
-            "T": "tango",
-            "U": "uniform",
-            "V": "victor",
-            "W": "whiskey",
-            "X": "x-ray",
-            "Y": "yankee",
-            "Z": "zulu",
-            "0": "zero",
-            "1": "one",
-            "2": "two",
-            "3": "three",
-            "4": "four",
-            "5": "five",
-            "6": "six",
-            "7": "seven",
-            "8": "eight",
-            "9": "niner",
-            ".": "point",
-        }
-        words = []
-        for char in plain.upper():
-            words.append(alphabet.get(char, char))
-        return words
+        return [
+            (PHONETIC_TABLE[ord(char)] or char) if char.isascii() else char
+            for char in plain
+        ]
 
     def move_nm(self, point, bearing, distance_nm):
         """Moves the point a specified distance (in nautical miles) in the given bearing (degrees)."""
@@ -335,7 +530,10 @@ def main():
         help="Radius in nautical miles to alert on approaching flights",
     )
     parser.add_argument(
-        "--announce", action="store_true", help="Announce approaching aircraft"
+        "--announce",
+        action="store_true",
+        default=None,
+        help="Announce approaching aircraft",
     )
     parser.add_argument(
         "-c",
@@ -351,22 +549,18 @@ def main():
     config = load_config(args.config_file)
 
     # Overwrite config with command-line arguments if provided
-    if args.username:
-        config["username"] = args.username
-    if args.password:
-        config["password"] = args.password
-    if args.latitude:
-        config["latitude"] = args.latitude
-    if args.longitude:
-        config["longitude"] = args.longitude
-    if args.interesting_radius:
-        config["interesting_radius"] = args.interesting_radius
-    if args.interesting_ceiling:
-        config["interesting_ceiling"] = args.interesting_ceiling
-    if args.alert_radius:
-        config["alert_radius"] = args.alert_radius
-    if args.announce:
-        config["announce"] = args.announce
+    for key in (
+        "username",
+        "password",
+        "latitude",
+        "longitude",
+        "interesting_radius",
+        "interesting_ceiling",
+        "alert_radius",
+        "announce",
+    ):
+        if (value := getattr(args, key)) is not None:
+            config[key] = value
 
     # Initialize and run the application
     app = App(config)